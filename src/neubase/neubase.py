@@ -1,14 +1,61 @@
-from sqlite3 import connect
-from os import listdir, path, mkdir
-from pandas import DataFrame, Index, ExcelWriter, read_csv, read_excel, read_sql, to_numeric, isnull
-from numpy import random
-from re import sub
-from json import dumps, loads
+from sqlite3 import connect, OperationalError
+from os import path, mkdir, scandir
+from contextlib import contextmanager
+from io import StringIO
+from pandas import DataFrame, Index, Series, ExcelFile, ExcelWriter, concat, read_csv, read_excel, read_json, read_sql, isnull
+from pandas import __version__ as _pandas_version
+from numpy import random, array, where, select, char
+from re import sub, compile as regex_compile
+from json import dumps
+from hashlib import blake2b
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
 from datetime import datetime
 import tarfile
 
 na_values=['-','*','..','.','SUPP','NA','NP','NE','NaN','DNS','No Pay Details Submitted']
 
+_non_alphanumeric = regex_compile(r'[^a-zA-Z0-9_ ]')
+_multiple_spaces = regex_compile(' +')
+
+_identifier = regex_compile(r'[A-Za-z0-9_][A-Za-z0-9_ ]*')
+
+_alphanumeric_keep = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_ '
+_alphanumeric_table = { code: None for code in range(128) if chr(code) not in _alphanumeric_keep }
+
+try:
+    import pyarrow
+    # read_csv's dtype_backend keyword needs pandas >= 2.0
+    use_arrow_backend = int( _pandas_version.split('.')[0] ) >= 2
+except ImportError:
+    use_arrow_backend = False
+
+_columns_cache = {}
+
+connection_pragmas = (
+    'PRAGMA journal_mode=WAL;',
+    'PRAGMA synchronous=NORMAL;',
+    'PRAGMA temp_store=MEMORY;',
+    'PRAGMA cache_size=-65536;',
+    'PRAGMA mmap_size=268435456;',
+    )
+
+columns_meta_dtypes = {
+    'input_name': 'string[pyarrow]',
+    'mc_name': 'string[pyarrow]',
+    'an_name': 'string[pyarrow]',
+    'mc_tag': 'string[pyarrow]',
+    'output_name': 'string[pyarrow]',
+    'dtype': 'category',
+    'mc_dtype': 'category',
+    'output_format': 'category',
+    'mc_display_order': 'int32',
+    'output_width': 'int16',
+    }
+
 class NEUBase():
     """NEUBase database connection
 
@@ -29,38 +76,35 @@ class NEUBase():
         if name is None:
             self.name = path.basename(file_location).split('.')[-2]
 
+        self._schema_dirty = True
+        self._column_cache = {}
+
+        self.connect()
         self.list_tables()
 
         if '__meta__' in self.table_list_full:
-            if not meta is None:
+            if meta is not None:
                 raise ValueError('Meta table already exists')
             else:
-                self.connect()
-                self.meta = read_sql('SELECT * FROM __meta__ WHERE table_name="__db__"', self.connection, index_col='key' ).drop(columns=['table_name']).to_dict()['value']
-                self.close()
+                self.meta = dict( self.cursor.execute('SELECT key, value FROM __meta__ WHERE table_name=?', ('__db__',)).fetchall() )
         else:
             if meta is None:
-                self.connect()
                 DataFrame(
                     data={
                         'table_name':[],
                         'value':[],
                         },
                     index=Index([], name='key')
-                ).to_sql("__meta__", self.connection)
-                self.close()
+                ).to_sql("__meta__", self.connection, method='multi', chunksize=1000)
             else:
                 keys = list(meta.keys())
                 table_name = ['__db__']*len(keys)
                 values = [ meta[key] for key in keys ]
                 meta_df = DataFrame( {'values':values, 'table_name':table_name}, index=Index(keys, name='key'))
-                self.connect()
-                meta_df.to_sql('__meta__', self.connection)
-                self.close()
+                meta_df.to_sql('__meta__', self.connection, method='multi', chunksize=1000)
                 self.meta = meta_df
 
         if not '__columns__' in self.table_list_full:
-            self.connect()
             DataFrame(
                 data={
                     'table_name':[],
@@ -76,17 +120,28 @@ class NEUBase():
                     'output_width':[],
                     },
                 index=Index([], name='db_name')
-            ).to_sql("__columns__", self.connection, if_exists='append')
-            self.close()
+            ).to_sql("__columns__", self.connection, if_exists='append', method='multi', chunksize=1000)
+
+        self.cursor.execute( 'CREATE INDEX IF NOT EXISTS idx_meta_table ON __meta__(table_name);' )
+        self.cursor.execute( 'CREATE INDEX IF NOT EXISTS idx_meta_key ON __meta__(key);' )
+        self.cursor.execute( 'CREATE INDEX IF NOT EXISTS idx_columns_table ON __columns__(table_name);' )
+        self.connection.commit()
+
+        if '__meta__' not in self.table_list_full or '__columns__' not in self.table_list_full:
+            self.refresh_schema()
 
 
     def connect(self):
         """Method to connect to SQLite database
 
         Creates connection accessed through connection variable.
+        The connection is opened once and reused on later calls.
         """
-        self.connection = connect( self.file_location )
-        self.cursor = self.connection.cursor()
+        if getattr( self, 'connection', None ) is None:
+            self.connection = connect( self.file_location, check_same_thread=False )
+            self.cursor = self.connection.cursor()
+            for pragma in connection_pragmas:
+                self.cursor.execute( pragma ).fetchall()
 
 
     def commit(self):
@@ -97,48 +152,132 @@ class NEUBase():
 
     def close(self):
         """Closes connection to database
+
+        Only needed for explicit shutdown; methods reuse the open
+        connection and reopen it on demand after a close.
+        """
+        if getattr( self, 'connection', None ) is not None:
+            self.connection.close()
+            self.connection = None
+            self.cursor = None
+
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    @contextmanager
+    def session(self):
+        """Context manager yielding the shared connection
+
+        Opens the connection if needed and closes it on exit.
         """
-        self.connection.close()
+        self.connect()
+        try:
+            yield self.connection
+        finally:
+            self.close()
 
 
-    def list_tables(self):
+    def list_tables(self, force=False):
         """Lists database tables
 
-        The list is stored in self.table_list
+        The list is stored in self.table_list and cached until the
+        schema changes; pass force=True to re-read regardless.
         Returns:
           list of table_list
         """
-        self.connect()
-        self.table_list_full = [ table[0] for table in self.cursor.execute("SELECT name FROM sqlite_master WHERE type ='table' AND name NOT LIKE 'sqlite_%';").fetchall() ]
-        self.close()
+        if force or getattr( self, '_schema_dirty', True ):
+            self.refresh_schema()
+
+        return self.table_list
 
+
+    def refresh_schema(self):
+        """Re-reads table, view and column information from the database.
+        """
         self.connect()
-        self.view_list = [ table[0] for table in self.cursor.execute("SELECT name FROM sqlite_master WHERE type ='view' AND name NOT LIKE 'sqlite_%';").fetchall() ]
-        self.close()
+        rows = self.cursor.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%';").fetchall()
+        self.table_list_full = [ name for name, table_type in rows if table_type == 'table' ]
+        self.view_list = [ name for name, table_type in rows if table_type == 'view' ]
 
-        self.table_list = [ table for table in self.table_list_full if table!='__meta__' or table!='__columns__' ]
+        self.table_list = [ table for table in self.table_list_full if table not in ('__meta__', '__columns__') ]
 
-        return self.table_list
+        self._column_cache = {}
+        self._schema_dirty = False
 
 
     def query(self, sql, index_col=None):
-        self.connect()
-
-        if not index_col is None:
-            data = read_sql( sql, self.connection, index_col = index_col )
+        """Runs sql and returns the result as a DataFrame.
+        """
+        rows, columns = self._execute( sql )
+        data = DataFrame.from_records( rows, columns=columns )
 
-        else:
-            data = read_sql( sql, self.connection )
+        if index_col is not None:
+            data.set_index( index_col, inplace=True )
 
-        self.close()
         return data
 
 
-    def list_columns( self, table ):
+    def query_rows(self, sql, params=None):
+        """Runs sql and returns the raw rows as a list of tuples.
+        """
+        return self._execute( sql, params )[0]
+
+
+    def query_dict(self, sql, params=None):
+        """Runs sql and returns a list of dicts keyed by column name.
+        """
+        rows, columns = self._execute( sql, params )
+        return [ dict( zip( columns, row ) ) for row in rows ]
+
+
+    def _execute(self, sql, params=None):
         self.connect()
-        column_list = [ col[1] for col in self.cursor.execute(f"PRAGMA table_info('{table}');").fetchall() ]
-        self.close()
-        return column_list
+        rows = self.cursor.execute( sql, params or () ).fetchall()
+        columns = [ description[0] for description in self.cursor.description ]
+        return rows, columns
+
+
+    def list_columns( self, table ):
+        if getattr( self, '_schema_dirty', True ):
+            self.refresh_schema()
+
+        if table not in self._column_cache:
+            self.connect()
+            self._column_cache[ table ] = [ col[1] for col in self.cursor.execute(f"PRAGMA table_info('{table}');").fetchall() ]
+        return self._column_cache[ table ]
+
+
+    def backup(self):
+        """Archives the working directory into archive/.
+
+        Compresses with zstandard when installed, falling back to gzip.
+        """
+        archive_base = f"archive/{self.meta['name']}_{now()}"
+
+        try:
+            import zstandard
+            stream = zstandard.ZstdCompressor( level=3, threads=-1 ).stream_writer( open( f'{archive_base}.tar.zst', 'wb' ) )
+            tar = tarfile.open( mode='w|', fileobj=stream )
+        except ImportError:
+            stream = None
+            tar = tarfile.open( f'{archive_base}.tar.gz', mode='w:gz', compresslevel=1 )
+
+        for entry in scandir('.'):
+            if entry.name == 'archive':
+                continue
+            if entry.is_file( follow_symlinks=False ) or entry.is_dir():
+                tar.add( entry.path )
+
+        tar.close()
+        if stream is not None:
+            stream.close()
 
 
 class NEUTable():
@@ -187,7 +326,9 @@ class NEUTable():
         if name in ['__db__', '__meta__', '__columns__']:
             raise ValueError(f'{name} cannot be used as a table name; it is reserved for system use.')
 
-        if not data is None:
+        validate_identifier( name )
+
+        if data is not None:
             self.column_names_group = 'input_name'
 
         if neubase is None:
@@ -195,7 +336,7 @@ class NEUTable():
             if meta_file is None:
                 raise ValueError("NEUBase not defined.")
 
-        if not meta_file is None:
+        if meta_file is not None:
             self.read_meta_file( meta_file )
             self.neubase = NEUBase( self.meta['db_file'] )
 
@@ -231,27 +372,52 @@ class NEUTable():
 
 
     def update_data_value(self, column, value, where):
-        sql = f"""
-            UPDATE {self.name}
-            SET {dumps(column)} = {dumps(value)}
-            WHERE {where};
+        self.update_data_values( [column], [value], where )
+
+
+    def update_data_values(self, columns, values, where):
+        """Updates columns to values on the rows matched by where.
+
+        Column names are validated against the table and values are
+        bound as parameters; sqlite3 reuses the prepared statement when
+        the generated SQL text repeats.
         """
+        table_columns = self.list_columns()
+
+        for column in columns:
+            if column not in table_columns:
+                raise ValueError( f'{column} is not a column of {self.name}.' )
+
+        set_clause = ", ".join( f'"{column}" = ?' for column in columns )
+
         self.neubase.connect()
-        self.neubase.cursor.execute( sql )
+        self.neubase.cursor.execute( f'UPDATE "{self.name}" SET {set_clause} WHERE {where};', tuple(values) )
         self.neubase.connection.commit()
-        self.neubase.close()
 
+    def update_many(self, column, pairs, key_column=None):
+        """Applies many updates to one column in a single transaction.
 
-    def update_data_values(self, columns, values, where):
-        sql = f"""
-            UPDATE {self.name}
-            SET {" = ?, ".join(columns)+" = ?"}
-            WHERE {where}
+        Args:
+          column: name of the column to update
+          pairs: list of (value, key) tuples, one per row to update
+          key_column: column matched against the key, defaults to the
+            first column of the table's sql_index
         """
+        if key_column is None:
+            sql_index = self.meta['sql_index']
+            key_column = sql_index if isinstance( sql_index, str ) else sql_index[0]
+
+        table_columns = self.list_columns()
+
+        for name in ( column, key_column ):
+            if name not in table_columns:
+                raise ValueError( f'{name} is not a column of {self.name}.' )
+
+        sql = f'UPDATE "{self.name}" SET "{column}" = ? WHERE "{key_column}" = ?;'
+
         self.neubase.connect()
-        self.neubase.cursor.execute( sql, tuple(values) )
-        self.neubase.connection.commit()
-        self.neubase.close()
+        with self.neubase.connection:
+            self.neubase.cursor.executemany( sql, [ tuple(pair) for pair in pairs ] )
 
 
     def create_meta_from_data(self):
@@ -260,7 +426,7 @@ class NEUTable():
         sql_index = list(self.data.index.names)
         name_map = {v: k for k, v in self.columns['input_name'].to_dict().items()}
         sql_index  = [ name_map[ i ] for i in sql_index ]
-        if not 'meta' in self.__dict__.keys():
+        if not hasattr(self, 'meta'):
             self.meta = {}
         self.meta['name']=self.name
         self.meta['db_file']=self.neubase.file_location
@@ -269,67 +435,161 @@ class NEUTable():
 
 
     def read_meta_file(self, meta_file=None):
+        """Reads the meta file into self.meta and self.columns.
+
+        Prefers the JSON side-car written by update_meta_file, which
+        skips the Excel parse entirely; the workbook is used instead
+        when it is newer than the side-car (hand edits) or when no
+        side-car exists.
+        """
         if meta_file is None:
-            if 'meta_file' in self.meta.keys():
+            if 'meta_file' in self.meta:
                 meta_file = self.meta['meta_file']
             else:
                 meta_file = self.meta_file
-        self.meta = read_excel( meta_file, sheet_name='Meta', index_col=0 ).to_dict()['value']
-        self.convert_meta_values_from_json()
-        self.columns = read_excel( meta_file, sheet_name='Columns' )
+
+        side_car = meta_side_car( meta_file )
+
+        if path.exists( side_car ) and ( not path.exists( meta_file ) or path.getmtime( side_car ) >= path.getmtime( meta_file ) ):
+            with open( side_car, 'rb' ) as handle:
+                side_car_data = loads( handle.read() )
+            self.meta = side_car_data['meta']
+            self.convert_meta_values_from_json()
+            self.columns = compact_columns_dtypes( read_json( StringIO( dumps( side_car_data['columns'] ) ), orient='table' ) )
+            return
+
+        with ExcelFile( meta_file ) as meta_xlsx:
+            self.meta = read_excel( meta_xlsx, sheet_name='Meta', index_col=0 ).to_dict()['value']
+            self.convert_meta_values_from_json()
+            self.columns = read_excel( meta_xlsx, sheet_name='Columns' )
         self.columns.set_index('db_name', inplace=True)
 
 
     def read_meta_tables(self):
         self.neubase.connect()
-        self.meta = read_sql( f'SELECT key, value FROM __meta__ WHERE table_name="{self.name}"', self.neubase.connection, index_col='key' ).to_dict()['value']
+        cursor = self.neubase.cursor
+        self.meta = dict( cursor.execute( 'SELECT key, value FROM __meta__ WHERE table_name=?', (self.name,) ).fetchall() )
         self.convert_meta_values_from_json()
-        self.columns = read_sql( f'SELECT * FROM __columns__ WHERE table_name="{self.name}"', self.neubase.connection, index_col='db_name' ).drop(columns=['table_name'])
-        self.neubase.close()
-
+        column_names = [ column for column in self.neubase.list_columns('__columns__') if column != 'table_name' ]
+        column_sql = ', '.join( f'"{column}"' for column in column_names )
+        rows = cursor.execute( f'SELECT {column_sql} FROM __columns__ WHERE table_name=?', (self.name,) ).fetchall()
+        columns = compact_columns_dtypes( DataFrame.from_records( rows, columns=column_names ).set_index('db_name') )
+
+        digest = blake2b( columns.to_csv().encode() ).digest()
+        if digest not in _columns_cache:
+            _columns_cache[ digest ] = columns
+        # self.columns is public and mutable, so hand out a copy rather
+        # than the cached frame itself
+        self.columns = _columns_cache[ digest ].copy()
 
     def read_data_from_file(self):
         options = { 'na_values' : na_values }
 
-        for option in [column for column in ['skiprows', 'usecols', 'names', 'sheet_name', 'index_col', 'dtypes'] if column in self.meta.keys()]:
-            if not self.meta[option] is None:
+        for option in ('skiprows', 'usecols', 'names', 'sheet_name', 'index_col', 'dtypes'):
+            if self.meta.get(option) is not None:
                 options[option] = self.meta[option]
 
-        if 'columns' in self.__dict__.keys():
+        if hasattr(self, 'columns'):
             dtypes = self.columns[['input_name','dtype']].set_index('input_name').to_dict()['dtype']
-        elif 'dtypes' in self.meta.keys():
+        elif 'dtypes' in self.meta:
             dtypes = self.meta['dtypes']
         else:
             dtypes = {}
 
         if self.meta['file'][-4:].lower() == '.csv':
             options[ 'dtype' ] = dtypes
+            if use_arrow_backend:
+                options[ 'dtype_backend' ] = 'pyarrow'
             self.data = read_csv(self.meta['file'], **options)
         else:
-            if 'index_col' in options.keys():
+            if 'index_col' in options:
                 index_col= options['index_col']
                 del(options['index_col'])
             else:
                 index_col= None
             self.data = read_excel(self.meta['file'], **options )
-            for key in [ key for key in dtypes.keys() if key in self.data.columns]:
-                self.data[key] = self.data[key].astype( dtypes[key], errors='ignore')
-                if dtypes[key][:3] == 'int' or dtypes[key][:5] == 'float':
-                    to_numeric( self.data[key], errors='coerce' )
 
-            if not index_col is None:
+            file_dtypes = { key: dtypes[key] for key in dtypes if key in self.data.columns }
+            if file_dtypes:
+                self.data = self.data.astype( file_dtypes, errors='ignore' )
+
+            if index_col is not None:
                 self.data.set_index( self.data.columns[index_col], inplace=True )
 
         self.column_names_group = 'input_name'
 
 
-    def read_data_table(self):
+    def stream_data_from_file(self, chunksize=100000):
+        """Streams a CSV data file straight into the data table.
+
+        Reads chunksize rows at a time so the full frame is never held
+        in memory; to_sql commits each chunk as it is written, so an
+        interrupted load can leave a partially filled table. Non-CSV
+        sources fall back to read_data_from_file followed by
+        overwrite_data_table.
+        """
+        if self.meta['file'][-4:].lower() != '.csv':
+            self.read_data_from_file()
+            self.overwrite_data_table()
+            return
+
+        options = { 'na_values' : na_values, 'chunksize' : chunksize }
+
+        for option in ('skiprows', 'usecols', 'names', 'index_col'):
+            if self.meta.get(option) is not None:
+                options[option] = self.meta[option]
+
+        if hasattr(self, 'columns'):
+            options['dtype'] = self.columns[['input_name','dtype']].set_index('input_name').to_dict()['dtype']
+            name_map = dict( zip( self.columns['input_name'].tolist(), self.columns.index.tolist() ) )
+        else:
+            name_map = {}
+
+        self.neubase.connect()
+        if_exists = 'replace'
+
+        with self.neubase.connection:
+            for chunk in read_csv( self.meta['file'], **options ):
+                if name_map:
+                    chunk.rename( columns=name_map, inplace=True )
+                    chunk.index.names = [ name_map.get( name, name ) for name in chunk.index.names ]
+                chunk.to_sql( self.name, self.neubase.connection, if_exists=if_exists, method='multi', chunksize=max( 1, 32766 // ( len(chunk.columns) + 1 ) ) )
+                if_exists = 'append'
+
+        self.neubase._schema_dirty = True
+        self.column_names_group = 'db_name'
+
+
+    def read_data_table(self, chunksize=50000):
+        """Reads the data table into self.data.
+
+        Rows are streamed in chunks of chunksize so peak memory stays
+        close to the size of the final DataFrame.
+        """
         self.neubase.connect()
-        self.data = read_sql( f'SELECT * FROM "{self.name}"', self.neubase.connection, index_col=self.meta['sql_index'] )
-        self.neubase.close()
+        sql_index = self.meta['sql_index']
+        chunks = list( read_sql( f'SELECT * FROM "{self.name}"', self.neubase.connection, index_col=sql_index, chunksize=chunksize ) )
+        if chunks:
+            self.data = concat( chunks, copy=False )
+        else:
+            self.data = DataFrame( columns=self.neubase.list_columns( self.name ) )
+        # an empty table can come back with index_col not applied
+        index_names = [ sql_index ] if isinstance( sql_index, str ) else list( sql_index )
+        if all( name in self.data.columns for name in index_names ):
+            self.data.set_index( sql_index, inplace=True )
         self.column_names_group = 'db_name'
 
 
+    def iter_chunks(self, chunksize=50000):
+        """Yields the data table in DataFrame chunks.
+
+        Useful for aggregations that never need the full table in
+        memory at once.
+        """
+        self.neubase.connect()
+        return read_sql( f'SELECT * FROM "{self.name}"', self.neubase.connection, index_col=self.meta['sql_index'], chunksize=chunksize )
+
+
     def list_columns(self):
         self.column_list = self.neubase.list_columns(self.name)
         return self.column_list
@@ -347,6 +607,13 @@ class NEUTable():
 
 
     def overwrite_data_table(self):
+        """Replaces the data table with the contents of self.data.
+
+        Durability is relaxed for the bulk write (synchronous=OFF,
+        journal_mode=MEMORY) and restored afterwards; a crash mid-write
+        can lose the table being replaced. User indexes on the table
+        are recreated after the load rather than updated per row.
+        """
         if self.column_names_group != 'db_name':
             self.rename_data_column_names()
 
@@ -354,29 +621,44 @@ class NEUTable():
             raise ValueError(f"The data columns and column meta do not match.")
 
         self.neubase.connect()
-        self.data.to_sql(self.name, self.neubase.connection, if_exists='replace')
-        self.neubase.close()
-        self.neubase.list_tables()
+        index_sql = [ row[0] for row in self.neubase.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL;", (self.name,) ).fetchall() ]
+
+        self.neubase.cursor.execute( 'PRAGMA synchronous=OFF;' ).fetchall()
+        self.neubase.cursor.execute( 'PRAGMA journal_mode=MEMORY;' ).fetchall()
+        try:
+            self.data.to_sql(self.name, self.neubase.connection, if_exists='replace', method='multi', chunksize=max( 1, 32766 // ( len(self.data.columns) + 1 ) ))
+            for sql in index_sql:
+                self.neubase.cursor.execute( sql )
+            self.neubase.connection.commit()
+        finally:
+            self.neubase.cursor.execute( 'PRAGMA journal_mode=WAL;' ).fetchall()
+            self.neubase.cursor.execute( 'PRAGMA synchronous=NORMAL;' ).fetchall()
+        self.neubase._schema_dirty = True
 
 
     def delete_data_table(self):
         self.neubase.connect()
         self.neubase.cursor.execute( f'DROP table "{self.name}";' )
         self.neubase.connection.commit()
-        self.neubase.close()
-
+        self.neubase._schema_dirty = True
 
     def delete_meta_tables(self):
         self.neubase.connect()
         self.neubase.cursor.execute( f'DELETE FROM __meta__ WHERE table_name="{self.name}";' )
         self.neubase.cursor.execute( f'DELETE FROM __columns__ WHERE table_name="{self.name}";' )
         self.neubase.connection.commit()
-        self.neubase.close()
-
+        self.neubase._schema_dirty = True
 
     def delete(self):
-        self.delete_data_table()
-        self.delete_meta_tables()
+        """Drops the data table and its meta rows in one transaction.
+        """
+        self.neubase.connect()
+        with self.neubase.connection:
+            self.neubase.cursor.execute( f'DROP table "{self.name}";' )
+            self.neubase.cursor.execute( f'DELETE FROM __meta__ WHERE table_name="{self.name}";' )
+            self.neubase.cursor.execute( f'DELETE FROM __columns__ WHERE table_name="{self.name}";' )
+        self.neubase._schema_dirty = True
 
 
     def delete_rows_from_data_table(self, where):
@@ -391,23 +673,59 @@ class NEUTable():
         self.neubase.connect()
         self.neubase.cursor.execute( f'DELETE FROM "{self.name}" WHERE {where};' )
         self.neubase.connection.commit()
-        self.neubase.close()
 
+    def insert_data_rows(self, columns, values, batch_size=None):
+        """Inserts rows into the data table inside a single transaction.
+
+        Args:
+          columns: list of column names to insert into
+          values: list of rows, each a list of values matching columns
+          batch_size: rows per batch, defaults to as many as fit under
+            SQLite's bound-variable limit
+        """
+        if batch_size is None:
+            batch_size = max( 1, 32766 // len(columns) )
 
-    def insert_data_rows(self, columns, values):
-        col_str = '"' + '", "'.join(columns) + '"'
-        val_str = (" ?,"*len(values[0]))[:-1]
+        col_str = '"' + '", "'.join( validate_identifier(column) for column in columns ) + '"'
+        row_placeholder = '(' + ",".join( ["?"] * len(columns) ) + ')'
         val_data = [ tuple(vs) for vs in values ]
 
-        sql = f"""
-            INSERT INTO {self.name}({ col_str })
-            VALUES({ val_str })
-        """
+        sql_prefix = f'INSERT INTO "{self.name}"({ col_str }) VALUES '
 
         self.neubase.connect()
-        self.neubase.cursor.executemany(sql, val_data)
-        self.neubase.connection.commit()
-        self.neubase.close()
+
+        if getattr( self, '_in_bulk_insert', False ):
+            self._insert_batches( sql_prefix, row_placeholder, val_data, batch_size )
+        else:
+            with self.neubase.connection:
+                self._insert_batches( sql_prefix, row_placeholder, val_data, batch_size )
+
+
+    def _insert_batches(self, sql_prefix, row_placeholder, val_data, batch_size):
+        for start in range( 0, len(val_data), batch_size ):
+            batch = val_data[ start : start + batch_size ]
+            sql = sql_prefix + ",".join( [row_placeholder] * len(batch) )
+            flat_values = [ value for row in batch for value in row ]
+            try:
+                self.neubase.cursor.execute( sql, flat_values )
+            except OperationalError:
+                if batch_size == 1:
+                    raise
+                self._insert_batches( sql_prefix, row_placeholder, batch, max( 1, batch_size // 2 ) )
+
+
+    @contextmanager
+    def bulk_insert(self):
+        """Context manager coalescing insert_data_row calls in a loop
+        into one transaction.
+        """
+        self.neubase.connect()
+        self._in_bulk_insert = True
+        try:
+            with self.neubase.connection:
+                yield self
+        finally:
+            self._in_bulk_insert = False
 
 
     def insert_data_row(self, columns, values):
@@ -415,73 +733,113 @@ class NEUTable():
 
 
     def update_meta_tables(self):
-        self.neubase.connect()
+        """Rewrites this table's rows in __meta__ and __columns__.
 
-        for table in ['__meta__','__columns__']:
-            sql = f'DELETE FROM {table} WHERE table_name="{self.name}";'
-            self.neubase.cursor.execute( sql )
-            self.neubase.connection.commit()
+        All deletes, inserts and schema tweaks run in one transaction
+        so the update costs a single commit.
+        """
+        self.neubase.connect()
+        cursor = self.neubase.cursor
+
+        with self.neubase.connection:
+            for table in ['__meta__','__columns__']:
+                cursor.execute( f'DELETE FROM {table} WHERE table_name="{self.name}";' )
+
+            meta_data = self.convert_meta_values_to_json()
+            cursor.executemany(
+                'INSERT INTO __meta__(key, value, table_name) VALUES (?, ?, ?)',
+                [ ( key, value, self.name ) for key, value in meta_data.items() ]
+                )
+
+            self.neubase.list_tables()
+            if '__columns__' in self.neubase.table_list_full:
+                columns_dbcolumns = self.neubase.list_columns('__columns__')
+                for column in self.columns.columns:
+                    if column not in columns_dbcolumns:
+                        cursor.execute(f'ALTER TABLE __columns__ ADD {column};')
+
+            # executemany rather than to_sql, which commits internally
+            # and would break the surrounding transaction
+            columns_frame = self.columns.assign( table_name=self.name ).reset_index().astype( object )
+            column_sql = ', '.join( f'"{column}"' for column in columns_frame.columns )
+            placeholders = ', '.join( '?' for _ in columns_frame.columns )
+            cursor.executemany(
+                f'INSERT INTO __columns__({column_sql}) VALUES ({placeholders})',
+                columns_frame.itertuples( index=False, name=None )
+                )
+
+        self.neubase._schema_dirty = True
+
+    def update_meta_file(self, meta_file=None, writer=None):
+        """Writes the Meta and Columns sheets of the meta file.
 
-        self.create_meta_df().assign(table_name=lambda x: self.name).to_sql('__meta__', self.neubase.connection, if_exists='append')
-
-        self.neubase.list_tables()
-        if '__columns__' in self.neubase.table_list_full:
-            self.neubase.connect()
-            columns_dbcolumns=[col[1] for col in self.neubase.cursor.execute('pragma table_info(__columns__)').fetchall()]
-            for column in self.columns.columns:
-                if column not in columns_dbcolumns:
-                    self.neubase.cursor.execute(f'ALTER TABLE __columns__ ADD {column};')
-            self.neubase.commit()
-        self.columns.assign(table_name=lambda x: self.name).to_sql('__columns__', self.neubase.connection, if_exists='append')
-        self.neubase.close()
-        self.neubase.list_tables()
-
-    def update_meta_file(self, meta_file=None):
+        Args:
+          meta_file: destination file, defaults to the location in meta
+          writer: an open ExcelWriter shared across tables; when given
+            the sheets are written into it under per-table names
+            ('{name}_Meta', '{name}_Columns') and the caller saves once
+        """
         if meta_file is None:
-            if 'meta_file' in self.meta.keys():
+            if 'meta_file' in self.meta:
                 meta_file = self.meta['meta_file']
             else:
                 meta_file = self.meta_file
-        writer = ExcelWriter( meta_file, engine='xlsxwriter' )
+
+        if writer is not None:
+            self.create_meta_df().to_excel( writer, sheet_name=f'{self.name}_Meta')
+            self.columns.to_excel( writer, sheet_name=f'{self.name}_Columns')
+            if meta_file is not None:
+                self.write_meta_side_car( meta_file )
+            return
+
+        writer = ExcelWriter( meta_file, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}} )
         meta_df = self.create_meta_df()
         meta_df.to_excel( writer, sheet_name='Meta')
         self.columns.to_excel( writer, sheet_name='Columns')
-        writer.save()
+        writer.close()
+        self.write_meta_side_car( meta_file )
+
+
+    def write_meta_side_car(self, meta_file):
+        """Writes the JSON side-car mirroring the meta file.
+        """
+        with open( meta_side_car( meta_file ), 'w' ) as handle:
+            handle.write( dumps( {
+                'meta': self.convert_meta_values_to_json(),
+                'columns': loads( self.columns.to_json( orient='table' ) ),
+                } ) )
+
+    def name_group_list(self, column_names_group):
+        """Returns the column names for a name group, whether it is
+        the index of self.columns or one of its columns.
+        """
+        if column_names_group == self.columns.index.name:
+            return self.columns.index.tolist()
+        return self.columns[ column_names_group ].tolist()
+
 
     def rename_data_column_names(self, new_column_names_group='db_name'):
         if new_column_names_group == self.column_names_group:
             print(f'Column names group unchanged, already {new_column_names_group}.')
             return
 
-        name_map = {}
-        old_column_names_group_list= []
-        columns = self.columns.reset_index()
-
-        for i, row in columns.iterrows():
-            name_map[ row[ self.column_names_group ] ] = row[ new_column_names_group ]
-            old_column_names_group_list.append(row[ self.column_names_group ] )
+        old_names = self.name_group_list( self.column_names_group )
+        new_names = self.name_group_list( new_column_names_group )
+        name_map = { old: new for old, new in zip( old_names, new_names ) if old != new }
 
-        self.data.rename( columns = name_map, inplace=True )
-        new_index_names = []
+        if name_map:
+            self.data.rename( columns = name_map, inplace=True )
+            self.data.index.names = [ name_map.get( name, name ) for name in self.data.index.names ]
 
-        for i in self.data.index.names:
-            if i in old_column_names_group_list:
-                new_index_names.append(name_map[i])
-            else:
-                new_index_names.append(i)
-
-        self.data.index.names = new_index_names
         self.column_names_group = new_column_names_group
 
 
     def create_meta_df(self):
         meta_data = self.convert_meta_values_to_json()
-        meta_keys = list(meta_data.keys())
-        meta_values = [ meta_data[key] for key in meta_keys ]
 
         return DataFrame(
-            data = {'value':meta_values},
-            index = Index(meta_keys, name='key')
+            data = {'value': list(meta_data.values())},
+            index = Index(list(meta_data.keys()), name='key')
             )
 
 
@@ -491,42 +849,48 @@ class NEUTable():
         """
 
         input_names = list( self.data.index.names ) + self.data.columns.tolist()
-        db_names = [ to_alphanumeric( name.lower() ).replace(' ','_') for name in input_names ]
+
+        clean_names = (
+            Series( input_names )
+            .str.replace( _non_alphanumeric, '', regex=True )
+            .str.replace( _multiple_spaces, ' ', regex=True )
+            .str.strip()
+            )
+
+        db_name_series = clean_names.str.lower().str.replace( ' ', '_', regex=False )
+        db_names = db_name_series.tolist()
         output_names = input_names
-        mc_names = [ to_alphanumeric( name.title() ).replace('_',' ') for name in db_names ]
+        mc_names = db_name_series.str.title().str.replace( '_', ' ', regex=False ).tolist()
         an_names = mc_names
-        mc_tag = [ to_alphanumeric( name.upper() ).replace('_','') for name in db_names ]
-        mc_dtype = []
+        mc_tag = db_name_series.str.upper().str.replace( '_', '', regex=False ).tolist()
 
         dtypes = (
             [ self.data.index.dtype.name ] * len( self.data.index.names ) +
-            [ dtype.name for dtype in self.data.dtypes ]
+            self.data.dtypes.astype(str).tolist()
             )
 
-        for dtype in dtypes:
-
-            if dtype == 'object':
-                mc_dtype.append( 'text' )
-
-            else:
-                mc_dtype.append( 'number' )
-
-        output_formats = []
-
-        for dtype in dtypes:
-
-            if dtype[:5] == 'float':
-                output_formats.append( 'float' )
-
-            elif dtype[:3] == 'int':
-                output_formats.append( 'int' )
+        dtype_array = array( dtypes )
+        is_text = (
+            char.startswith( dtype_array, 'object' )
+            | char.startswith( dtype_array, 'string' )
+            | char.startswith( dtype_array, 'large_string' )
+            )
+        mc_dtype = where( is_text, 'text', 'number' ).tolist()
 
-            else:
-                output_formats.append( 'str' )
+        is_float = (
+            char.startswith( dtype_array, 'float' )
+            | char.startswith( dtype_array, 'double' )
+            | char.startswith( dtype_array, 'halffloat' )
+            )
+        output_formats = select(
+            [ is_float, char.startswith( dtype_array, 'int' ) ],
+            [ 'float', 'int' ],
+            default='str'
+            ).tolist()
 
         mc_col_nums = list( range( len( input_names ) ) )
 
-        self.columns = DataFrame(
+        self.columns = compact_columns_dtypes( DataFrame(
             data={
                 'input_name': input_names,
                 'mc_name': mc_names,
@@ -540,15 +904,15 @@ class NEUTable():
                 'output_width': [20] * len( input_names )
                 },
             index=Index( db_names, name='db_name')
-            )
+            ) )
 
 
     def convert_meta_values_from_json(self):
-        for value in self.meta.keys():
-            if not self.meta[value] is None:
+        for key, value in self.meta.items():
+            if isinstance( value, str ) and value and value[0] in '[{"tfn0123456789-':
                 try:
-                    self.meta[ value ] = loads( self.meta[ value ] )
-                except:
+                    self.meta[ key ] = loads( value )
+                except ValueError:
                     pass
 
 
@@ -582,14 +946,13 @@ class NEUTable():
         freeze_cols = None
         ):
 
-        if 'output_format' in self.columns.columns:
-            col_format = [self.columns.output_format.loc[col] for col in self.data.columns]
-        else:
-            col_format = [self.columns.dtype.loc[col] for col in self.data.columns]
+        format_column = 'output_format' if 'output_format' in self.columns.columns else 'dtype'
+        col_format = self.columns[ format_column ].reindex( self.data.columns ).tolist()
 
-        col_width = [self.columns.col_width.loc[col] for col in self.data.columns]
+        width_column = 'output_width' if 'output_width' in self.columns.columns else 'col_width'
+        col_width = self.columns[ width_column ].reindex( self.data.columns ).tolist()
 
-        if 'output_dir' in self.meta.keys():
+        if 'output_dir' in self.meta:
             dir_name = f'{self.meta["output_dir"]}_{now()}'
             if not path.exists( dir_name ):
                 mkdir( dir_name )
@@ -613,68 +976,40 @@ class NEUTable():
                 filename = f'{filename[:-5]} (1).xlsx'
             loop_count += 1
 
-        self.data.to_excel(writer, 'Sheet1', index=True, startrow=1, header=False )
+        index = True
+        self.data.to_excel(writer, 'Sheet1', index=index, startrow=1, header=False )
         workbook = writer.book
         worksheet = writer.sheets[ 'Sheet1' ]
-        if not header is None:
+        if header is not None:
             worksheet.set_header( header )
-        if not footer is None:
+        if footer is not None:
             worksheet.set_footer( footer )
         if fit_to_columns:
             worksheet.fit_to_pages(1, 0)
         if col_color is None:
             col_color = random_color()
-        header_format = workbook.add_format()
-        header_format.set_text_wrap()
-        header_format.set_align('top')
-        header_format.set_bold()
-        header_format.set_bg_color( col_color )
-        header_format.set_align('center')
-        header_format.set_border()
-        index_format = workbook.add_format()
-        index_format.set_align('top')
-        index_format.set_align('left')
-        index_format.set_bold()
-        index_format.set_border()
-        index_num_format = workbook.add_format()
-        index_num_format.set_bold()
-        index_num_format.set_border()
-        percent_format = workbook.add_format()
-        percent_format.set_num_format('0"%"')
-        dec_percent_format = workbook.add_format()
-        dec_percent_format.set_num_format('0.0"%"')
-        real_percent_format= workbook.add_format()
-        real_percent_format.set_num_format('0%')
-        real_dec_percent_format = workbook.add_format()
-        real_dec_percent_format.set_num_format('0.0%')
-        gbp_format = workbook.add_format()
-        gbp_format.set_num_format('"£"#,##0')
-        int_format = workbook.add_format()
-        int_format.set_num_format('#,##0')
-        dec_format = workbook.add_format()
-        dec_format.set_num_format('0.0')
-        str_format = workbook.add_format()
-        num_format = str_format
-        wrap_format = workbook.add_format()
-        wrap_format.set_text_wrap()
-
+        formats = workbook_formats( workbook, col_color )
+        header_format = formats['header']
+        index_num_format = formats['index_num']
+        wrap_format = formats['wrap']
+        num_format = formats['str']
 
         for i, cf in enumerate(col_format):
             if cf[:3].lower() == 'int' or cf == 'int'[:len(cf)]:
-                num_format = int_format
-            if cf[:5].lower() == 'float':
-                num_format = dec_format
-            if cf.lower() == 'percent':
-                num_format = percent_format
-            if cf.lower() == 'dec_percent':
-                num_format = dec_percent_format
-            if cf.lower() == 'r_percent':
-                num_format = real_percent_format
-            if cf.lower() == 'r_dec_percent':
-                num_format = real_dec_percent_format
-            if cf.lower() == 'gbp':
-                num_format = gbp_format
-            if cf.lower() == 'wrap':
+                num_format = formats['int']
+            elif cf[:5].lower() == 'float':
+                num_format = formats['dec']
+            elif cf.lower() == 'percent':
+                num_format = formats['percent']
+            elif cf.lower() == 'dec_percent':
+                num_format = formats['dec_percent']
+            elif cf.lower() == 'r_percent':
+                num_format = formats['real_percent']
+            elif cf.lower() == 'r_dec_percent':
+                num_format = formats['real_dec_percent']
+            elif cf.lower() == 'gbp':
+                num_format = formats['gbp']
+            elif cf.lower() == 'wrap':
                 num_format = wrap_format
             if index and i < len(self.data.index.names):
                 worksheet.set_column(i,i,col_width[i],index_num_format)
@@ -696,32 +1031,132 @@ class NEUTable():
                     worksheet.write( self.data.shape[0] + 3 + i, 0, note)
         if wrap_cols != []:
             for col in wrap_cols:
-                row_no = 1
-                for row in self.data.iterrows():
-                    if not isnull( row[1][col] ):
-                        worksheet.write( row_no, col, row[1][col], wrap_format)
-                    row_no += 1
-        writer.save()
+                values = self.data.iloc[:, col].to_numpy() if isinstance( col, int ) else self.data[col].to_numpy()
+                mask = ~isnull( values )
+                for row_no, value in zip( ( mask.nonzero()[0] + 1 ).tolist(), values[mask].tolist() ):
+                    worksheet.write( row_no, col, value, wrap_format)
+        writer.close()
 
 
 
-def to_alphanumeric( text ):
-#  return sub('/^[a-z\d\-_\s]+$/i',' ',text).strip()
-    return sub(' +',' ', sub(r'[^a-zA-Z0-9_ ]',r'',text)).strip()
+def workbook_formats( workbook, col_color ):
+    """Returns the shared cell formats for a workbook.
 
+    Formats are built once per workbook and header colour and stored on
+    the workbook itself, so exporting many sheets into one workbook does
+    not rebuild identical styles and formats never outlive their
+    workbook.
+    """
+    cache = getattr( workbook, '_neubase_formats', None )
+
+    if cache is None:
+        cache = {}
+        workbook._neubase_formats = cache
+
+    if col_color in cache:
+        return cache[ col_color ]
+
+    header_format = workbook.add_format()
+    header_format.set_text_wrap()
+    header_format.set_align('top')
+    header_format.set_bold()
+    header_format.set_bg_color( col_color )
+    header_format.set_align('center')
+    header_format.set_border()
+    index_format = workbook.add_format()
+    index_format.set_align('top')
+    index_format.set_align('left')
+    index_format.set_bold()
+    index_format.set_border()
+    index_num_format = workbook.add_format()
+    index_num_format.set_bold()
+    index_num_format.set_border()
+    percent_format = workbook.add_format()
+    percent_format.set_num_format('0"%"')
+    dec_percent_format = workbook.add_format()
+    dec_percent_format.set_num_format('0.0"%"')
+    real_percent_format= workbook.add_format()
+    real_percent_format.set_num_format('0%')
+    real_dec_percent_format = workbook.add_format()
+    real_dec_percent_format.set_num_format('0.0%')
+    gbp_format = workbook.add_format()
+    gbp_format.set_num_format('"£"#,##0')
+    int_format = workbook.add_format()
+    int_format.set_num_format('#,##0')
+    dec_format = workbook.add_format()
+    dec_format.set_num_format('0.0')
+    str_format = workbook.add_format()
+    wrap_format = workbook.add_format()
+    wrap_format.set_text_wrap()
+
+    cache[ col_color ] = {
+        'header': header_format,
+        'index': index_format,
+        'index_num': index_num_format,
+        'percent': percent_format,
+        'dec_percent': dec_percent_format,
+        'real_percent': real_percent_format,
+        'real_dec_percent': real_dec_percent_format,
+        'gbp': gbp_format,
+        'int': int_format,
+        'dec': dec_format,
+        'str': str_format,
+        'wrap': wrap_format,
+        }
+
+    return cache[ col_color ]
+
+
+def meta_side_car( meta_file ):
+    """Returns the JSON side-car path for an Excel meta file.
+    """
+    return path.splitext( meta_file )[0] + '.json'
 
-def backup(self):
-    files = [ f for f in listdir('.') if path.isfile(f) ]
-    folders = [ f for f in listdir('.') if path.isdir(f) and f != 'archive' ]
-    tar = tarfile.open(f"archive/{self.meta['name']}_{now()}.gz")
 
-    for folder in folders:
-        tar.add( folder )
+def validate_identifier( name ):
+    """Returns name if it is safe to use as a quoted SQL identifier.
 
-    for file in files:
-        tar.add( file )
+    Raises:
+      ValueError: if name contains anything beyond letters, digits,
+        underscores and spaces
+    """
+    if _identifier.fullmatch( name ) is None:
+        raise ValueError( f'{name} is not a valid SQL identifier.' )
+    return name
+
+
+def compact_columns_dtypes( columns ):
+    """Shrinks a columns meta DataFrame.
+
+    Uses Arrow-backed strings for the name columns and categories for
+    the low-cardinality dtype columns. String columns are left alone
+    when pyarrow is not installed or use_arrow_backend is False.
+    """
+    dtypes = {}
 
-    tar.close()
+    for column, dtype in columns_meta_dtypes.items():
+
+        if column not in columns.columns:
+            continue
+
+        if dtype == 'string[pyarrow]' and not use_arrow_backend:
+            continue
+
+        dtypes[ column ] = dtype
+
+    return columns.astype( dtypes, errors='ignore' )
+
+
+def to_alphanumeric( text ):
+    """Strips text down to letters, digits, underscores and single spaces.
+
+    ASCII input goes through a precomputed translation table; anything
+    else falls back to the module-level compiled regexes.
+    """
+#  return sub('/^[a-z\d\-_\s]+$/i',' ',text).strip()
+    if text.isascii():
+        return _multiple_spaces.sub(' ', text.translate(_alphanumeric_table)).strip()
+    return _multiple_spaces.sub(' ', _non_alphanumeric.sub('', text)).strip()
 
 
 def now():